@@ -1,123 +1,295 @@
-import os
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import aiohttp
+import orjson
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import Message
 
+from config import settings
+from storage import PriceStore
+
 # -------------------- ЛОГИ --------------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 log = logging.getLogger("meteorite")
 
 # -------------------- ENV --------------------
-TG_TOKEN = os.getenv("TG_TOKEN", "")
-ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
-OZON_CLIENT_ID = os.getenv("OZON_CLIENT_ID", "")
-OZON_API_KEY = os.getenv("OZON_API_KEY", "")
+# всё из окружения (и .env) читает config.Settings; здесь — короткие имена для кода ниже
+TG_TOKEN = settings.tg_token
+ADMIN_IDS = settings.admin_ids
+OZON_CLIENT_ID = settings.ozon_client_id
+OZON_API_KEY = settings.ozon_api_key
+OZON_HEADERS = {"Client-Id": OZON_CLIENT_ID, "Api-Key": OZON_API_KEY, "Content-Type": "application/json"}
+# максимум, который отдают v3/product/list и v5/product/info/prices за один запрос
+OZON_PAGE_LIMIT = 1000
 
 # список юнитов для мониторинга (через .env)
-WATCH_OFFERS = [s.strip() for s in os.getenv("WATCH_OFFERS", "").split(",") if s.strip()]
-WATCH_PRODUCTS = [int(s) for s in os.getenv("WATCH_PRODUCTS", "").split(",") if s.strip().isdigit()]
+# frozenset: is_watched проверяет каждый товар каждой страницы, membership должен быть O(1)
+WATCH_OFFERS = settings.watch_offers
+WATCH_PRODUCTS = settings.watch_products
 
 # пороги/настройки
-HEARTBEAT_MINUTES = int(os.getenv("HEARTBEAT_MINUTES", "180"))  # 3 часа
-HEARTBEAT_CHAT_ID = int(os.getenv("HEARTBEAT_CHAT_ID", ADMIN_IDS[0] if ADMIN_IDS else "0"))
-
-POLL_PERIOD_SEC = int(os.getenv("POLL_PERIOD_SEC", "300"))      # 5 минут
-CHANGE_CONFIRMS = int(os.getenv("CHANGE_CONFIRMS", "2"))        # сколькими циклами подтвердить
-PRICE_TOLERANCE = int(os.getenv("PRICE_TOLERANCE", "1"))        # «погрешность» в рублях
+HEARTBEAT_MINUTES = settings.heartbeat_minutes
+TOUCH_DEBOUNCE_SEC = 1.0                                         # сек, как часто обновлять отметку активности
+HEARTBEAT_MIN_SLEEP = 5                                          # сек, нижняя граница сна heartbeat
+HEARTBEAT_CHAT_ID = settings.heartbeat_chat_id
+
+POLL_PERIOD_SEC = settings.poll_period_sec
+TG_POLL_TIMEOUT = settings.tg_poll_timeout
+TG_MESSAGE_LIMIT = 4000                                         # у Telegram потолок 4096 символов, берём с запасом
+CHANGE_CONFIRMS = settings.change_confirms
+PRICE_TOLERANCE = settings.price_tolerance
+
+# push-уведомления Ozon
+OZON_WEBHOOK_PORT = settings.ozon_webhook_port
+OZON_WEBHOOK_PATH = settings.ozon_webhook_path
+OZON_PRICE_EVENTS = frozenset({"TYPE_PRICE_INDEX_CHANGED", "TYPE_UPDATE_ITEM"})
+POLL_FALLBACK_SEC = settings.poll_fallback_sec
+CATALOG_TTL_SEC = settings.catalog_ttl_sec
+
+PRICES_DB = settings.prices_db
+PRICE_CACHE_MAX = settings.price_cache_max
+PRICE_TTL_DAYS = settings.price_ttl_days
+LAST_SEEN_SAVE_SEC = 3600                                        # как часто писать в sqlite last_seen неизменившихся офферов
 
 # -------------------- BOT/DP --------------------
 bot = Bot(token=TG_TOKEN, default_parse_mode=ParseMode.HTML)
 dp = Dispatcher()
 
 # -------------------- Состояние --------------------
-last_activity: datetime = datetime.now()
+# time.monotonic(): не скачет при переводе часов/NTP и не аллоцирует datetime на каждый touch
+last_activity_mono: float = time.monotonic()
 last_cycle_at: Optional[datetime] = None
 last_alert_at: Optional[datetime] = None
 
 class PriceState:
     __slots__ = ("price", "confirm", "last_seen")
-    def __init__(self, price: int):
+    def __init__(self, price: int, last_seen: Optional[datetime] = None):
         self.price = price
         self.confirm = 0
-        self.last_seen = datetime.now()
+        self.last_seen = last_seen or datetime.now()
 
-# k: offer_id -> PriceState
-buyer_prices: Dict[str, PriceState] = {}
+# k: offer_id -> PriceState; порядок — LRU (в конце недавно виденные), чтобы кэш не рос бесконечно
+buyer_prices: "OrderedDict[str, PriceState]" = OrderedDict()
 no_marketing_now: int = 0
+# последний полный срез offer_id -> marketing_price, для быстрого «ничего не изменилось»
+last_observed: Dict[str, int] = {}
+# последний полный ответ по ценам (его же показывает /prices, пока свежий)
+price_items_cache: List[dict] = []
+price_items_at: Optional[float] = None  # time.monotonic()
+# кэш каталога: по странице (offer_ids, product_ids) — ровно то, что уходит в запрос цен
+catalog_pages: Optional[List[Tuple[List[str], List[int]]]] = None
+catalog_fetched_at: Optional[float] = None  # time.monotonic()
+# sqlite открывает main(): импорт bot не должен трогать диск (и падать на недоступном PRICES_DB)
+price_store: Optional[PriceStore] = None
+pending_saves: Dict[str, Optional[PriceState]] = {}  # ещё не записанные в sqlite изменения
+last_seen_saved_at: Optional[float] = None  # time.monotonic(), когда last_seen всех видимых офферов ушёл в sqlite
+
+# asyncio-примитивы создаёт main(), уже внутри работающего цикла: на Python 3.9
+# созданные при импорте Lock/Event/Semaphore привязываются к другому loop
+save_lock: Optional[asyncio.Lock] = None
+# не больше 3 одновременных запросов цен на весь процесс, чтобы не ловить 429 от Ozon
+OZON_PRICES_CONCURRENCY = 3
+OZON_PRICES_SEM: Optional[asyncio.Semaphore] = None
+
+# общая HTTP-сессия к Ozon (создаётся в main, закрывается при выходе), чтобы не платить TCP+TLS на каждый запрос
+SESSION: Optional[aiohttp.ClientSession] = None
+
+# очередь товаров из push-уведомлений Ozon и задача, которая её разбирает (одна на процесс)
+webhook_offers: set[str] = set()
+webhook_products: set[int] = set()
+webhook_task: Optional[asyncio.Task] = None
+
+# сильные ссылки на фоновые задачи: loop держит только weakref, без этого GC может их снести
+BG_TASKS: set[asyncio.Task] = set()
+
+# STOP — бот завершается; REFRESH — внеочередной цикл мониторинга (/refresh)
+STOP: Optional[asyncio.Event] = None
+REFRESH: Optional[asyncio.Event] = None
+
+async def pause(event: asyncio.Event, timeout: float) -> None:
+    """Как asyncio.sleep(timeout), но просыпается сразу, если выставили event."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
 
 def touch_alive(note: str = "") -> None:
-    global last_activity
-    last_activity = datetime.now()
+    global last_activity_mono
+    now = time.monotonic()
+    # heartbeat меряет минуты — чаще раза в секунду отметку (и лог) не обновляем
+    if now - last_activity_mono < TOUCH_DEBOUNCE_SEC:
+        return
+    last_activity_mono = now
     if note:
         log.debug("alive: %s", note)
 
 # -------------------- Ozon Seller API --------------------
-async def get_ozon_products(limit: int = 100) -> List[dict]:
-    """Возвращает items с offer_id/product_id, с фильтром по WATCH_* если задан."""
+def is_watched(item: dict) -> bool:
+    """Попадает ли товар под фильтр WATCH_* (пустой фильтр — следим за всеми)."""
+    return (
+        (not WATCH_OFFERS or item.get("offer_id") in WATCH_OFFERS)
+        and (not WATCH_PRODUCTS or item.get("product_id") in WATCH_PRODUCTS)
+    )
+
+async def iter_ozon_product_pages(limit: int = OZON_PAGE_LIMIT) -> AsyncIterator[List[dict]]:
+    """Отдаёт страницы {offer_id, product_id} по мере загрузки, с фильтром по WATCH_* если задан."""
     url = "https://api-seller.ozon.ru/v3/product/list"
-    headers = {"Client-Id": OZON_CLIENT_ID, "Api-Key": OZON_API_KEY, "Content-Type": "application/json"}
 
-    all_items: List[dict] = []
-    offset = 0
+    # курсор v3: сервер продолжает с last_id, а не пропускает offset записей;
+    # тело собираем один раз и в цикле меняем только курсор
+    payload = {"filter": {"visibility": "ALL"}, "limit": limit, "last_id": ""}
 
-    async with aiohttp.ClientSession() as session:
-        while True:
-            payload = {"filter": {"visibility": "ALL"}, "limit": limit, "offset": offset}
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    log.error("products %s: %s", resp.status, text)
-                    break
-                data = await resp.json()
-                items = data.get("result", {}).get("items", [])
-                if not items:
-                    break
-
-                if WATCH_OFFERS or WATCH_PRODUCTS:
-                    items = [
-                        it for it in items
-                        if (not WATCH_OFFERS or it.get("offer_id") in WATCH_OFFERS)
-                        and (not WATCH_PRODUCTS or it.get("product_id") in WATCH_PRODUCTS)
-                    ]
-
-                all_items.extend(items)
-                if len(items) < limit:
-                    break
-                offset += limit
+    while True:
+        async with SESSION.post(url, data=orjson.dumps(payload)) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                log.error("products %s: %s", resp.status, text)
+                # недогруженный список нельзя принимать за полный (он уйдёт в кэш каталога)
+                resp.raise_for_status()
+            data = orjson.loads(await resp.read())  # orjson сразу из bytes, без декодирования в str
+            result = data.get("result", {})
+            items = result.get("items", [])
+            if not items:
+                break
+
+            # конец списка смотрим по «сырой» странице — после WATCH-фильтра она может быть короче limit
+            payload["last_id"] = result.get("last_id") or ""
+            page_full = len(items) == limit
+
+            # дальше нужны только id — полные карточки страницы не держим, пока её обрабатывают
+            items = [
+                {"offer_id": it.get("offer_id"), "product_id": it.get("product_id")}
+                for it in items if is_watched(it)
+            ]
+            if items:
+                yield items
+            if not payload["last_id"] or not page_full:
+                break
 
     touch_alive("ozon_products")
-    return all_items
 
 
-async def get_ozon_prices(offer_ids: List[str], product_ids: List[int]) -> Optional[dict]:
-    """v5/product/info/prices — берём только marketing_price как «цену для покупателя»."""
-    if not offer_ids and not product_ids:
-        return {"items": []}
+async def _cancel_all(tasks: List[asyncio.Task]) -> None:
+    """Отменяет задачи и дожидается их, чтобы не висели сиротами и не сыпали «exception was never retrieved»."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _gather_all(tasks: List[asyncio.Task]) -> list:
+    """asyncio.gather, но если одна задача упала — остальные отменяем, а не бросаем работать фоном."""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        await _cancel_all(tasks)
+        raise
 
+async def _fetch_prices_chunk(offer_ids: List[str], product_ids: List[int]) -> Optional[List[dict]]:
+    """Одна пачка id (не больше OZON_PAGE_LIMIT), листаем по cursor. None — ошибка."""
     url = "https://api-seller.ozon.ru/v5/product/info/prices"
-    headers = {"Client-Id": OZON_CLIENT_ID, "Api-Key": OZON_API_KEY, "Content-Type": "application/json"}
     payload = {
         "cursor": "",
         "filter": {"offer_id": offer_ids, "product_id": product_ids, "visibility": "ALL"},
-        "limit": 100,
+        "limit": OZON_PAGE_LIMIT,
     }
+    items: List[dict] = []
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as resp:
-            text = await resp.text()
-            if resp.status != 200:
-                log.error("prices %s: %s", resp.status, text)
-                return None
-            data = await resp.json()
-            touch_alive("ozon_prices")
-            return data
+    async with OZON_PRICES_SEM:
+        while True:
+            async with SESSION.post(url, data=orjson.dumps(payload)) as resp:
+                if resp.status != 200:
+                    text = await resp.text()
+                    log.error("prices %s: %s", resp.status, text)
+                    if 400 <= resp.status < 500 and resp.status != 429:
+                        # скорее всего, в кэше каталога есть удалённые offer_id — перечитаем список
+                        invalidate_catalog()
+                    return None
+                data = orjson.loads(await resp.read())
+
+            page = data.get("items", [])
+            items.extend(page)
+            payload["cursor"] = data.get("cursor") or ""
+            if not page or not payload["cursor"]:
+                return items
+
+async def get_ozon_prices(offer_ids: List[str], product_ids: List[int]) -> Optional[dict]:
+    """v5/product/info/prices — берём только marketing_price как «цену для покупателя».
+
+    id режем на пачки по OZON_PAGE_LIMIT (иначе Ozon молча обрезает ответ) и тянем их параллельно.
+    Возвращаем {"items": [...]} по всем пачкам или None при ошибке.
+    """
+    if not offer_ids and not product_ids:
+        return {"items": []}
+
+    step = OZON_PAGE_LIMIT
+    chunks = await _gather_all([
+        asyncio.create_task(_fetch_prices_chunk(offer_ids[i:i + step], product_ids[i:i + step]))
+        for i in range(0, max(len(offer_ids), len(product_ids)), step)
+    ])
+    if any(chunk is None for chunk in chunks):
+        return None
+
+    touch_alive("ozon_prices")
+    return {"items": [it for chunk in chunks for it in chunk]}
+
+def invalidate_catalog() -> None:
+    global catalog_pages, catalog_fetched_at
+    catalog_pages, catalog_fetched_at = None, None
+
+async def fetch_watched_prices() -> Optional[List[dict]]:
+    """Цены по всем отслеживаемым товарам.
+
+    Каталог меняется редко, поэтому список товаров берём из кэша (CATALOG_TTL_SEC).
+    Когда кэш протух, цены страницы запрашиваются сразу, пока грузится следующая страница списка,
+    так что задержки v3/product/list и v5/product/info/prices перекрываются.
+    None — если список товаров или хоть один запрос цен не удался.
+    """
+    global catalog_pages, catalog_fetched_at
+    tasks: List[asyncio.Task]
+    if catalog_pages is not None and time.monotonic() - catalog_fetched_at < CATALOG_TTL_SEC:
+        tasks = [asyncio.create_task(get_ozon_prices(o, p)) for o, p in catalog_pages]
+    else:
+        tasks = []
+        pages: List[Tuple[List[str], List[int]]] = []
+        try:
+            async for page in iter_ozon_product_pages():
+                offer_ids = [it.get("offer_id") for it in page if it.get("offer_id")]
+                product_ids = [it.get("product_id") for it in page if it.get("product_id")]
+                pages.append((offer_ids, product_ids))
+                tasks.append(asyncio.create_task(get_ozon_prices(offer_ids, product_ids)))
+        except BaseException as e:
+            await _cancel_all(tasks)
+            if isinstance(e, aiohttp.ClientResponseError):
+                return None  # уже залогировали в iter_ozon_product_pages
+            raise
+        catalog_pages, catalog_fetched_at = pages, time.monotonic()
+
+    results = await _gather_all(tasks)
+    if not all(results):
+        return None
+    return [it for data in results for it in data.get("items", [])]
+
+def invalidate_price_items() -> None:
+    global price_items_at
+    price_items_at = None
+
+async def get_price_items(max_age: float = 0) -> Optional[List[dict]]:
+    """fetch_watched_prices через кэш: результат моложе max_age секунд отдаём из памяти без похода в Ozon."""
+    global price_items_cache, price_items_at
+    if max_age and price_items_at is not None and time.monotonic() - price_items_at < max_age:
+        return price_items_cache
+
+    items = await fetch_watched_prices()
+    if items is not None:
+        price_items_cache, price_items_at = items, time.monotonic()
+    return items
 
 def pick_buyer_price(item: dict) -> Optional[int]:
     """Цена для покупателя — строго marketing_price; если нет/0 — вернём None."""
@@ -129,8 +301,35 @@ def pick_buyer_price(item: dict) -> Optional[int]:
         mp = None
     return mp if mp and mp > 0 else None
 
-def arrow(old: int, new: int) -> str:
-    return "↑" if new > old else "↓"
+# строка изменения цены: шаблон выбираем одним сравнением, без отдельной функции-стрелки
+CHANGE_UP = "• %s: %d ₽ → %d ₽ ↑"
+CHANGE_DOWN = "• %s: %d ₽ → %d ₽ ↓"
+
+def render_price_line(item: dict) -> Tuple[str, bool]:
+    """Строка /prices для товара и флаг «нет marketing_price».
+
+    offer_id используем как «читаемое имя»; цена — тем же pick_buyer_price, что и в мониторинге.
+    """
+    offer = item.get("offer_id")
+    buyer = pick_buyer_price(item)
+    if buyer is None:
+        return f"• {offer}: — (нет маркетинговой цены)", True
+    return f"• {offer}: {buyer} ₽", False
+
+def split_message(lines: List[str], limit: int = TG_MESSAGE_LIMIT) -> List[str]:
+    """Склеивает строки в сообщения не длиннее limit символов (строки не разрываем)."""
+    chunks: List[str] = []
+    buf: List[str] = []
+    size = 0
+    for line in lines:
+        if buf and size + len(line) + 1 > limit:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+        buf.append(line)
+        size += len(line) + 1
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
 
 # -------------------- Команды --------------------
 HELP_TEXT = (
@@ -138,7 +337,8 @@ HELP_TEXT = (
     "Команды:\n"
     "/prices — текущие цены\n"
     "/monitor — включить мониторинг (уведомлю об изменениях)\n"
-    "/health — состояние бота и мониторинга"
+    "/health — состояние бота и мониторинга\n"
+    "/refresh — проверить цены прямо сейчас (для админов)"
 )
 
 @dp.message(Command("start"))
@@ -148,38 +348,29 @@ async def cmd_start(message: Message):
 
 @dp.message(Command("prices"))
 async def cmd_prices(message: Message):
-    products = await get_ozon_products()
-    if not products:
-        await message.answer("Не удалось получить список товаров.")
-        return
-
-    offer_ids = [it.get("offer_id") for it in products if it.get("offer_id")]
-    product_ids = [it.get("product_id") for it in products if it.get("product_id")]
-
-    data = await get_ozon_prices(offer_ids, product_ids)
-    if not data:
+    # мониторинг и так обновляет цены раз в POLL_PERIOD_SEC — свежий срез берём из памяти
+    items = await get_price_items(max_age=POLL_PERIOD_SEC)
+    if items is None:
         await message.answer("Ошибка при запросе цен.")
         return
+    if not items:
+        await message.answer("Не удалось получить список товаров.")
+        return
 
-    lines = ["Текущие цены для покупателя:"]
-    miss = 0
-    for it in data.get("items", []):
-        offer = it.get("offer_id")  # используем как «читаемое имя»
-        buyer = pick_buyer_price(it)
-        if buyer is None:
-            miss += 1
-            lines.append(f"• {offer}: — (нет маркетинговой цены)")
-        else:
-            lines.append(f"• {offer}: {buyer} ₽")
+    rendered = [render_price_line(it) for it in items]
+    miss = sum(is_miss for _, is_miss in rendered)
+    header = "Текущие цены для покупателя:"
+    footer = f"\nНедоступна маркетинговая цена: {miss} шт."
 
-    lines.append(f"\nНедоступна маркетинговая цена: {miss} шт.")
-    await message.answer("\n".join(lines))
+    # длинный каталог не влезает в одно сообщение; части шлём по порядку
+    for chunk in split_message([header, *(line for line, _ in rendered), footer]):
+        await message.answer(chunk)
     touch_alive("cmd_prices")
 
 @dp.message(Command("health"))
 async def cmd_health(message: Message):
     now = datetime.now()
-    silence = int((now - last_activity).total_seconds() // 60)
+    silence = int((time.monotonic() - last_activity_mono) // 60)
     last_cycle_txt = "-" if not last_cycle_at else f"{int((now - last_cycle_at).total_seconds() // 60)} мин назад"
     last_alert_txt = "-" if not last_alert_at else f"{int((now - last_alert_at).total_seconds() // 60)} мин назад"
 
@@ -199,6 +390,14 @@ async def cmd_monitor(message: Message):
     await message.answer("Мониторинг уже работает в фоне. Сообщу, если цена для покупателя изменится устойчиво.")
     touch_alive("cmd_monitor")
 
+@dp.message(Command("refresh"))
+async def cmd_refresh(message: Message):
+    if message.from_user is None or message.from_user.id not in ADMIN_IDS:
+        return
+    REFRESH.set()
+    await message.answer("Запустил внеочередную проверку цен.")
+    touch_alive("cmd_refresh")
+
 # ---------- дружелюбный ответ на любое обычное сообщение ----------
 @dp.message(F.text & ~F.text.startswith("/"))
 async def greet_any_text(message: Message):
@@ -206,104 +405,361 @@ async def greet_any_text(message: Message):
     touch_alive("greet_any")
 
 # -------------------- Мониторинг --------------------
+def collect_changes(
+    items: List[dict], full: bool = True, now: Optional[datetime] = None
+) -> Tuple[List[str], int, Dict[str, Optional[PriceState]]]:
+    """Сверяет marketing_price с buyer_prices.
+
+    full=True — это полный срез всех отслеживаемых товаров (цикл мониторинга);
+    для точечных обновлений (webhook) передаём False. now — время среза (по умолчанию сейчас).
+    Возвращает (строки изменений, сколько без marketing_price, новые/изменённые записи кэша для сохранения;
+    None в них — оффер вытеснен из кэша и его надо удалить).
+    """
+    global last_observed, last_seen_saved_at
+    # 1) Собираем наблюдения по marketing_price
+    missing = 0
+    observed: Dict[str, int] = {}
+    for it in items:
+        offer = it.get("offer_id")
+        buyer = pick_buyer_price(it)  # только marketing_price (>0), иначе None
+        if buyer is None:
+            missing += 1
+            continue
+        observed[offer] = buyer
+
+    prev_observed = last_observed
+    # пока сверка не дошла до конца, эталона нет: если она упадёт,
+    # следующий полный срез сверится целиком, а не уйдёт в быстрый путь
+    last_observed = {}
+
+    changes: List[str] = []
+    updated: Dict[str, Optional[PriceState]] = {}
+    now = now or datetime.now()
+
+    # 2) Отмечаем, что видели: last_seen — время последнего наблюдения (от него считается PRICE_TTL_DAYS),
+    # а не последнего изменения, поэтому проходим по всем офферам среза, а не только по изменившимся.
+    # Видимые уходят в конец LRU, так что при переполнении первыми вытесняются пропавшие
+    for offer, cur_price in observed.items():
+        state = buyer_prices.get(offer)
+        # первый раз видим — просто запоминаем
+        if state is None:
+            buyer_prices[offer] = updated[offer] = PriceState(cur_price, now)
+            continue
+        state.last_seen = now
+        buyer_prices.move_to_end(offer)
+
+    # на диск last_seen неизменившихся офферов пишем не каждый цикл, а раз в LAST_SEEN_SAVE_SEC
+    # (и сразу после рестарта), чтобы в sqlite было реальное время наблюдения
+    if full and (last_seen_saved_at is None or time.monotonic() - last_seen_saved_at >= LAST_SEEN_SAVE_SEC):
+        for offer in observed:
+            updated.setdefault(offer, buyer_prices[offer])
+        last_seen_saved_at = time.monotonic()
+
+    # 3) Вычисляем изменения (без дебаунса/толеранса)
+    # быстрый путь: полный срез совпал с прошлым — сравнение двух dict целиком идёт в C.
+    # Иначе относительно эталона перебираем только новые/изменившиеся пары, в порядке выдачи Ozon
+    # (разность множеств дала бы порядок хэшей, разный от запуска к запуску); без эталона — сверяем всё
+    if full and observed == prev_observed:
+        fresh = []
+    elif prev_observed:
+        fresh = [(offer, price) for offer, price in observed.items() if prev_observed.get(offer) != price]
+    else:
+        fresh = observed.items()
+
+    for offer, cur_price in fresh:
+        state = buyer_prices[offer]
+        # если цена реально изменилась — фиксируем и сообщаем
+        if cur_price != state.price:
+            prev = state.price
+            state.price = cur_price
+            updated[offer] = state
+            # формируем красивую строку-элемент списка
+            changes.append((CHANGE_UP if cur_price > prev else CHANGE_DOWN) % (offer, prev, cur_price))
+
+    # 3) Вытесняем: офферы, которых давно нет в полном срезе, и всё сверх PRICE_CACHE_MAX
+    if full:
+        # пропавшие с прошлого среза: сохраняем их last_seen (последний цикл, где их видели) без задержки
+        for offer in prev_observed.keys() - observed.keys():
+            state = buyer_prices.get(offer)
+            if state is not None:
+                updated[offer] = state
+
+        # идёт и на быстром пути (срез не изменился), иначе пропавшие висели бы, пока не сменится чья-то цена.
+        # Видимые офферы только что ушли в конец LRU, так что голова упорядочена по last_seen:
+        # снимаем протухших с начала и останавливаемся на первом свежем, без прохода по всему кэшу
+        expire_before = now - timedelta(days=PRICE_TTL_DAYS)
+        while buyer_prices:
+            offer, state = next(iter(buyer_prices.items()))
+            if state.last_seen >= expire_before:
+                break
+            del buyer_prices[offer]
+            updated[offer] = None
+    while len(buyer_prices) > PRICE_CACHE_MAX:
+        offer, _ = buyer_prices.popitem(last=False)
+        updated[offer] = None
+
+    # эталоном срез становится только после того, как сверка и вытеснение прошли целиком;
+    # точечное обновление (webhook) эталон не сбрасывает, а поправляет в нём свои офферы
+    if full:
+        last_observed = observed
+    else:
+        prev_observed.update(observed)
+        last_observed = prev_observed
+    return changes, missing, updated
+
+async def save_prices(updated: Dict[str, Optional[PriceState]]) -> None:
+    """Пишем в sqlite только изменившиеся строки; ошибка диска не должна ломать мониторинг.
+
+    Не записанное (ошибка) остаётся в pending_saves и уйдёт со следующим вызовом,
+    а лок не даёт двум записям (цикл и webhook) завершиться в обратном порядке.
+    """
+    pending_saves.update(updated)
+    async with save_lock:
+        if not pending_saves:
+            return
+        batch = dict(pending_saves)
+        pending_saves.clear()
+        rows = [(offer, st.price, st.last_seen.timestamp()) for offer, st in batch.items() if st is not None]
+        removed = [offer for offer, st in batch.items() if st is None]
+        try:
+            await asyncio.to_thread(price_store.save, rows, removed)
+        except Exception as e:
+            log.warning("save prices failed (%d rows pending): %s", len(batch), e)
+            # более свежие значения, пришедшие пока писали, не затираем
+            for offer, st in batch.items():
+                pending_saves.setdefault(offer, st)
+
+async def load_prices() -> None:
+    """Поднимаем кэш цен из sqlite, чтобы первый цикл после рестарта уже мог сравнивать."""
+    try:
+        saved = await asyncio.to_thread(price_store.load)
+    except Exception as e:
+        log.warning("load prices failed: %s", e)
+        return
+    # last_seen берём сохранённый: пропавшие до рестарта офферы продолжают стареть к PRICE_TTL_DAYS
+    for offer, (price, last_seen) in saved.items():
+        buyer_prices[offer] = PriceState(price, datetime.fromtimestamp(last_seen))
+    log.info("loaded %d saved prices", len(saved))
+
+async def alert_changes(changes: List[str], now: Optional[datetime] = None) -> None:
+    """Отправляем все изменения админам единым сообщением (или несколькими, если не влезает)."""
+    global last_alert_at
+    if not changes:
+        return
+
+    last_alert_at = now or datetime.now()
+    chunks = split_message(["Цены изменились по следующим товарам:", *changes])
+
+    async def send_all(chat_id: int) -> None:
+        for chunk in chunks:
+            await bot.send_message(chat_id, chunk)
+
+    # шлём всем админам параллельно: один RTT вместо len(ADMIN_IDS)
+    results = await asyncio.gather(*(send_all(a) for a in ADMIN_IDS), return_exceptions=True)
+    for admin, res in zip(ADMIN_IDS, results):
+        if isinstance(res, Exception):
+            log.warning("send to %s failed: %s", admin, res)
+
 async def check_prices_periodically():
     """Следим только за marketing_price. Оповещаем сразу при фактическом изменении."""
-    global last_cycle_at, last_alert_at, no_marketing_now
+    global last_cycle_at, no_marketing_now
 
-    while True:
-        try:
-            # 1) Берём список отслеживаемых товаров
-            products = await get_ozon_products()
-            offer_ids = [it.get("offer_id") for it in products if it.get("offer_id")]
-            product_ids = [it.get("product_id") for it in products if it.get("product_id")]
+    # если Ozon шлёт push-уведомления, опрос нужен только как страховка
+    period = max(POLL_PERIOD_SEC, POLL_FALLBACK_SEC) if OZON_WEBHOOK_PORT else POLL_PERIOD_SEC
 
-            # 2) Тянем цены
-            data = await get_ozon_prices(offer_ids, product_ids)
-            if not data:
-                await asyncio.sleep(POLL_PERIOD_SEC)
-                continue
+    while not STOP.is_set():
+        # одно время на весь цикл: last_seen, last_alert_at и last_cycle_at согласованы
+        cycle_now = datetime.now()
+        try:
+            # 1) Тянем список отслеживаемых товаров и их цены
+            items = await get_price_items()
+            if items is not None:
+                # 2) Сверяем с кэшем и отправляем изменения
+                changes, no_marketing_now, updated = collect_changes(items, now=cycle_now)
+                await save_prices(updated)
+                await alert_changes(changes, now=cycle_now)
 
-            # 3) Собираем наблюдения по marketing_price
-            no_marketing_now = 0
-            observed: Dict[str, int] = {}
-            for it in data.get("items", []):
-                offer = it.get("offer_id")
-                buyer = pick_buyer_price(it)  # только marketing_price (>0), иначе None
-                if buyer is None:
-                    no_marketing_now += 1
-                    continue
-                observed[offer] = buyer
-
-            # 4) Вычисляем изменения (без дебаунса/толеранса)
-            changes: List[str] = []
-            now = datetime.now()
-
-            for offer, cur_price in observed.items():
-                state = buyer_prices.get(offer)
-
-                # первый раз видим — просто запоминаем
-                if state is None:
-                    buyer_prices[offer] = PriceState(cur_price)
-                    continue
-
-                # обновляем метку последнего наблюдения
-                state.last_seen = now
-
-                # если цена реально изменилась — фиксируем и сообщаем
-                if cur_price != state.price:
-                    prev = state.price
-                    state.price = cur_price
-                    # формируем красивую строку-элемент списка
-                    changes.append(f"• {offer}: {prev} ₽ → {cur_price} ₽ {arrow(prev, cur_price)}")
-
-            # 5) Отправляем единым сообщением
-            if changes:
-                last_alert_at = datetime.now()
-                text = "Цены изменились по следующим товарам:\n" + "\n".join(changes)
-                for admin in ADMIN_IDS:
-                    try:
-                        await bot.send_message(admin, text)
-                    except Exception as e:
-                        log.warning("send to %s failed: %s", admin, e)
-
-            last_cycle_at = datetime.now()
-            touch_alive("cycle_ok")
+                last_cycle_at = cycle_now
+                touch_alive("cycle_ok")
 
         except Exception as e:
             log.exception("periodic error: %s", e)
 
-        await asyncio.sleep(POLL_PERIOD_SEC)
+        # ждём следующего цикла, /refresh или остановки
+        await pause(REFRESH, period)
+        REFRESH.clear()
+
+# -------------------- Ozon push-уведомления --------------------
+def json_response(data: dict, status: int = 200) -> web.Response:
+    """web.json_response, но тело сериализует orjson прямо в bytes."""
+    return web.Response(body=orjson.dumps(data), status=status, content_type="application/json")
+
+def event_watched(offer_id: Optional[str], product_id: Optional[int]) -> bool:
+    """is_watched по тем полям, что есть в событии: отсутствующее поле (у индекса цен нет offer_id) не отсекает."""
+    if not offer_id and not product_id:
+        return False
+    return (
+        (not offer_id or not WATCH_OFFERS or offer_id in WATCH_OFFERS)
+        and (not product_id or not WATCH_PRODUCTS or product_id in WATCH_PRODUCTS)
+    )
+
+def queue_price_event(offer_id: Optional[str], product_id: Optional[int]) -> None:
+    """Ставит товар из push-уведомления в очередь на перезапрос цены.
+
+    Повторные события по одному товару схлопываются в множествах, а запрос к Ozon идёт
+    не больше одного за раз — всплеск (или подделка) событий не съедает квоту и не ломает опрос.
+    """
+    global webhook_task
+    if offer_id:
+        webhook_offers.add(offer_id)
+    if product_id:
+        webhook_products.add(product_id)
+    if len(webhook_offers) > OZON_PAGE_LIMIT or len(webhook_products) > OZON_PAGE_LIMIT:
+        # столько разных товаров разом — дешевле один внеочередной полный цикл
+        webhook_offers.clear()
+        webhook_products.clear()
+        REFRESH.set()
+        return
+    if webhook_task is None or webhook_task.done():
+        webhook_task = asyncio.create_task(refresh_webhook_prices())
+        BG_TASKS.add(webhook_task)
+        webhook_task.add_done_callback(BG_TASKS.discard)
+
+async def refresh_webhook_prices() -> None:
+    """Перезапрашиваем цены товаров из очереди webhook и сверяем с кэшем.
+
+    События, пришедшие во время запроса, копятся и уходят следующей пачкой.
+    """
+    while webhook_offers or webhook_products:
+        offer_ids, product_ids = list(webhook_offers), list(webhook_products)
+        webhook_offers.clear()
+        webhook_products.clear()
+        try:
+            data = await get_ozon_prices(offer_ids, product_ids)
+            if data:
+                changes, _, updated = collect_changes(
+                    [it for it in data.get("items", []) if is_watched(it)], full=False
+                )
+                if updated:
+                    # срез в кэше /prices отстал от webhook — следующий /prices сходит в Ozon
+                    invalidate_price_items()
+                await save_prices(updated)
+                await alert_changes(changes)
+        except Exception as e:
+            log.exception("webhook refresh error: %s", e)
+
+async def ozon_webhook(request: web.Request) -> web.Response:
+    """Приёмник push-уведомлений Ozon: на событие цены перезапрашиваем только этот товар."""
+    try:
+        event = orjson.loads(await request.read())
+    except Exception:
+        event = None
+    if not isinstance(event, dict):
+        return json_response({"error": {"code": "ERROR_PARAMETER_VALUE_MISSED", "message": "bad json"}}, status=400)
+
+    kind = event.get("message_type")
+    if kind == "TYPE_PING":
+        return json_response({
+            "version": "1.0",
+            "name": "meteorite_bot",
+            "time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+
+    if kind in OZON_PRICE_EVENTS:
+        offer_id, product_id = event.get("offer_id"), event.get("product_id")
+        if event_watched(offer_id, product_id):
+            # Ozon ждёт ответа недолго: подтверждаем сразу, а запрос цены и рассылку ведём фоном
+            queue_price_event(offer_id, product_id)
+        touch_alive("ozon_webhook")
+
+    return json_response({"result": True})
+
+async def start_ozon_webhook() -> Optional[web.AppRunner]:
+    if not OZON_WEBHOOK_PORT:
+        return None
+    app = web.Application()
+    app.router.add_post(OZON_WEBHOOK_PATH, ozon_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", OZON_WEBHOOK_PORT).start()
+    log.info("ozon webhook listening on :%s%s", OZON_WEBHOOK_PORT, OZON_WEBHOOK_PATH)
+    return runner
 
 # -------------------- Heartbeat --------------------
 async def heartbeat_watcher():
-    global last_activity
-    threshold = timedelta(minutes=HEARTBEAT_MINUTES)
+    threshold = HEARTBEAT_MINUTES * 60
     if not HEARTBEAT_CHAT_ID:
         log.warning("HEARTBEAT_CHAT_ID not set — heartbeat тихий.")
         return
 
-    while True:
+    while not STOP.is_set():
         try:
-            silence = datetime.now() - last_activity
-            if silence > threshold:
-                try:
-                    await bot.send_message(
-                        HEARTBEAT_CHAT_ID,
-                        f"⚠️ Тишина: нет активности {int(silence.total_seconds() // 60)} мин (порог {HEARTBEAT_MINUTES})."
-                    )
-                except Exception as e:
-                    log.warning("heartbeat send failed: %s", e)
-                touch_alive("heartbeat_alert")
+            silence = time.monotonic() - last_activity_mono
+            remaining = threshold - silence
+            if remaining > 0:
+                # спим ровно до момента, когда тишина может превысить порог;
+                # если за это время была активность — просто пересчитаем дедлайн.
+                # Не меньше HEARTBEAT_MIN_SLEEP, чтобы у самого дедлайна не крутиться микросонами
+                await pause(STOP, max(HEARTBEAT_MIN_SLEEP, remaining))
+                continue
+
+            try:
+                await bot.send_message(
+                    HEARTBEAT_CHAT_ID,
+                    f"⚠️ Тишина: нет активности {int(silence // 60)} мин (порог {HEARTBEAT_MINUTES})."
+                )
+            except Exception as e:
+                log.warning("heartbeat send failed: %s", e)
+            touch_alive("heartbeat_alert")
+            # после тревоги ждём хотя бы минуту (или порог): при HEARTBEAT_MINUTES=0 дедлайн всегда в прошлом
+            await pause(STOP, max(60, threshold))
         except Exception as e:
             log.error("heartbeat error: %s", e)
-
-        await asyncio.sleep(60)
+            await pause(STOP, 60)
 
 # -------------------- ENTRYPOINT --------------------
 async def main():
-    asyncio.create_task(check_prices_periodically())
-    asyncio.create_task(heartbeat_watcher())
-    await dp.start_polling(bot)
+    global SESSION, STOP, REFRESH, save_lock, OZON_PRICES_SEM, price_store
+    STOP, REFRESH = asyncio.Event(), asyncio.Event()
+    save_lock = asyncio.Lock()
+    OZON_PRICES_SEM = asyncio.Semaphore(OZON_PRICES_CONCURRENCY)
+    price_store = PriceStore(PRICES_DB)
+    # весь трафик — на один api-seller.ozon.ru: небольшой пул (цены ≤ 3 параллельно + список товаров)
+    # с потолком на хост, чтобы всплеск запросов не упирался в 429; DNS кэшируем между циклами
+    connector = aiohttp.TCPConnector(limit=20, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=75)
+    await load_prices()
+    # заголовки авторизации Ozon и таймаут — на уровне сессии, для всех запросов сразу
+    session = aiohttp.ClientSession(
+        connector=connector,
+        headers=OZON_HEADERS,
+        timeout=aiohttp.ClientTimeout(total=60),
+    )
+    async with session as SESSION:
+        webhook = await start_ozon_webhook()
+        for coro in (check_prices_periodically(), heartbeat_watcher()):
+            task = asyncio.create_task(coro)
+            BG_TASKS.add(task)
+            task.add_done_callback(BG_TASKS.discard)
+        try:
+            # SIGINT/SIGTERM перехватывает aiogram: start_polling просто вернётся
+            # allowed_updates aiogram сам выводит из хендлеров (у нас только message)
+            await dp.start_polling(bot, polling_timeout=TG_POLL_TIMEOUT)
+        finally:
+            STOP.set()
+            REFRESH.set()
+            # сначала закрываем приёмник, чтобы push-уведомления не добавляли задач, пока ждём BG_TASKS
+            if webhook:
+                await webhook.cleanup()
+            if BG_TASKS:
+                _, pending = await asyncio.wait(BG_TASKS, timeout=10)
+                for task in pending:
+                    task.cancel()
 
 if __name__ == "__main__":
+    # uvloop заметно быстрее стандартного цикла; если не установлен (Windows) — работаем как раньше
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
@@ -4,19 +4,48 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-def _parse_admins(s: str):
-    if not s: 
-        return []
-    return [int(x.strip()) for x in s.split(',') if x.strip()]
+def _parse_admins(s: str) -> tuple[int, ...]:
+    if not s:
+        return ()
+    return tuple(int(x) for x in s.replace(" ", "").split(",") if x)
+
+def _parse_csv(s: str) -> frozenset[str]:
+    return frozenset(x.strip() for x in s.split(",") if x.strip())
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
 
 @dataclass
 class Settings:
     tg_token: str = os.getenv("TG_TOKEN", "")
-    admin_ids: list[int] = None
+    admin_ids: tuple[int, ...] = None
     ozon_client_id: str = os.getenv("OZON_CLIENT_ID", "")
     ozon_api_key: str = os.getenv("OZON_API_KEY", "")
 
+    # список юнитов для мониторинга; пустой — следим за всеми
+    watch_offers: frozenset[str] = _parse_csv(os.getenv("WATCH_OFFERS", ""))
+    watch_products: frozenset[int] = frozenset(int(s) for s in _parse_csv(os.getenv("WATCH_PRODUCTS", "")) if s.isdigit())
+
+    # пороги/настройки
+    heartbeat_minutes: int = _int("HEARTBEAT_MINUTES", 180)         # 3 часа
+    heartbeat_chat_id: int = None                                    # по умолчанию первый из ADMIN_IDS
+    poll_period_sec: int = _int("POLL_PERIOD_SEC", 300)              # 5 минут
+    tg_poll_timeout: int = _int("TG_POLL_TIMEOUT", 25)               # long-poll getUpdates, сек
+    change_confirms: int = _int("CHANGE_CONFIRMS", 2)                # сколькими циклами подтвердить
+    price_tolerance: int = _int("PRICE_TOLERANCE", 1)                # «погрешность» в рублях
+
+    # push-уведомления Ozon (URL регистрируется в кабинете продавца); 0 — выключено
+    ozon_webhook_port: int = _int("OZON_WEBHOOK_PORT", 0)
+    ozon_webhook_path: str = os.getenv("OZON_WEBHOOK_PATH", "/ozon")
+    poll_fallback_sec: int = _int("POLL_FALLBACK_SEC", 1800)         # 30 минут, если есть webhook
+    catalog_ttl_sec: int = _int("CATALOG_TTL_SEC", 1800)             # список товаров перечитываем раз в 30 минут
+
+    prices_db: str = os.getenv("PRICES_DB", "prices.db")            # sqlite с последними ценами
+    price_cache_max: int = _int("PRICE_CACHE_MAX", 100000)           # потолок офферов в кэше цен
+    price_ttl_days: int = _int("PRICE_TTL_DAYS", 7)                  # пропавший из выдачи оффер забываем через N дней
+
     def __post_init__(self):
         self.admin_ids = _parse_admins(os.getenv("ADMIN_IDS", ""))
+        self.heartbeat_chat_id = int(os.getenv("HEARTBEAT_CHAT_ID", self.admin_ids[0] if self.admin_ids else 0))
 
 settings = Settings()
@@ -1,21 +1,53 @@
+import asyncio
+import aiohttp
+import orjson
 import requests
-from typing import List, Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Dict, Any, Optional
+
+BASE_URL = "https://api-seller.ozon.ru"
+
+def _auth_headers(client_id: str, api_key: str) -> Dict[str, str]:
+    return {
+        "Client-Id": str(client_id),
+        "Api-Key": api_key,
+        "Content-Type": "application/json"
+    }
+
+def _collect_prices(out: Dict[str, Dict[str, Any]], result: List[dict]) -> None:
+    for item in result:
+        offer_id = item.get("offer_id") or str(item.get("product_id"))
+        prices = item.get("prices", {}) or {}
+        out[offer_id] = {
+            "product_id": item.get("product_id"),
+            "price": prices.get("price"),
+            "old_price": prices.get("old_price"),
+            "price_with_discount": prices.get("price_with_discount"),
+            "currency_code": prices.get("currency_code"),
+        }
 
 class OzonClient:
     def __init__(self, client_id: str, api_key: str):
-        self.base = "https://api-seller.ozon.ru"
-        self.headers = {
-            "Client-Id": str(client_id),
-            "Api-Key": api_key,
-            "Content-Type": "application/json"
-        }
+        self.base = BASE_URL
+        self.headers = _auth_headers(client_id, api_key)
+        # одна сессия с пулом: чанки цен и страницы списка идут по уже открытому TCP+TLS
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # raise_on_status=False: после последней попытки отдаём ответ как есть, и raise_for_status()
+        # по-прежнему бросает HTTPError, а не RetryError
+        retry = Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None, raise_on_status=False,
+        )
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
 
     def list_products(self, limit: int = 1000, visibility: str = "ALL") -> list[dict]:
         items = []
         last_id = ""
         while True:
             body = {"filter": {"visibility": visibility}, "last_id": last_id, "limit": limit}
-            r = requests.post(f"{self.base}/v3/product/list", headers=self.headers, json=body, timeout=60)
+            r = self.session.post(f"{self.base}/v3/product/list", json=body, timeout=60)
             r.raise_for_status()
             data = r.json().get("result", {})
             chunk = data.get("items", [])
@@ -31,16 +63,74 @@ class OzonClient:
         out: Dict[str, Dict[str, Any]] = {}
         for i in range(0, len(product_ids), 90):
             chunk = product_ids[i:i+90]
-            r = requests.post(f"{self.base}/v4/product/info/prices", headers=self.headers, json={"product_id": chunk}, timeout=60)
+            r = self.session.post(f"{self.base}/v4/product/info/prices", json={"product_id": chunk}, timeout=60)
             r.raise_for_status()
-            for item in r.json().get("result", []):
-                offer_id = item.get("offer_id") or str(item.get("product_id"))
-                prices = item.get("prices", {}) or {}
-                out[offer_id] = {
-                    "product_id": item.get("product_id"),
-                    "price": prices.get("price"),
-                    "old_price": prices.get("old_price"),
-                    "price_with_discount": prices.get("price_with_discount"),
-                    "currency_code": prices.get("currency_code"),
-                }
+            _collect_prices(out, r.json().get("result", []))
+        return out
+
+class AsyncOzonClient:
+    """То же, что OzonClient, но без блокировки event loop.
+
+    bot.py в Ozon ходит сам (v3/v5 через общую SESSION); этот клиент — для своих async-скриптов
+    и интеграций (выгрузки, отчёты), которым нужен API OzonClient без requests в event loop.
+
+    async with AsyncOzonClient(client_id, api_key) as ozon:
+        items = await ozon.list_products()
+    """
+
+    def __init__(self, client_id: str, api_key: str, concurrency: int = 4):
+        self.base = BASE_URL
+        self.headers = _auth_headers(client_id, api_key)
+        self.concurrency = concurrency
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncOzonClient":
+        # семафор создаём уже в работающем цикле: на Python 3.9 он привязывается к loop при создании
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(headers=self.headers, timeout=aiohttp.ClientTimeout(total=60))
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.session.close()
+        self.session = None
+
+    async def _post(self, path: str, body: dict) -> dict:
+        async with self._sem:
+            async with self.session.post(f"{self.base}{path}", data=orjson.dumps(body)) as r:
+                r.raise_for_status()
+                return orjson.loads(await r.read())
+
+    async def list_products(self, limit: int = 1000, visibility: str = "ALL") -> list[dict]:
+        items = []
+        last_id = ""
+        while True:
+            body = {"filter": {"visibility": visibility}, "last_id": last_id, "limit": limit}
+            data = (await self._post("/v3/product/list", body)).get("result", {})
+            chunk = data.get("items", [])
+            if not chunk:
+                break
+            items.extend(chunk)
+            last_id = data.get("last_id") or ""
+            if not last_id:
+                break
+        return items
+
+    async def _fetch_chunk(self, chunk: List[int]) -> List[dict]:
+        return (await self._post("/v4/product/info/prices", {"product_id": chunk})).get("result", [])
+
+    async def prices_by_product_ids(self, product_ids: List[int]) -> Dict[str, Dict[str, Any]]:
+        # чанки по 90 уходят параллельно, одновременно — не больше concurrency запросов
+        tasks = [asyncio.create_task(self._fetch_chunk(product_ids[i:i+90])) for i in range(0, len(product_ids), 90)]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # упал один чанк — остальные отменяем и дожидаемся, а не оставляем работать сиротами
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        out: Dict[str, Dict[str, Any]] = {}
+        for result in results:
+            _collect_prices(out, result)
         return out
@@ -0,0 +1,37 @@
+import sqlite3
+import time
+from contextlib import closing
+from typing import Dict, Iterable, Tuple
+
+class PriceStore:
+    """Последние известные цены для покупателя (offer_id -> price, last_seen) в sqlite, чтобы пережить рестарт."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            # WAL: запись не блокирует чтение и переживает падение процесса посреди транзакции
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prices("
+                "offer TEXT PRIMARY KEY, price INTEGER NOT NULL, last_seen REAL NOT NULL DEFAULT 0)"
+            )
+            # база от старой версии без last_seen: считаем, что всё видели сейчас, и дальше записи стареют
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(prices)")}
+            if "last_seen" not in columns:
+                conn.execute("ALTER TABLE prices ADD COLUMN last_seen REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE prices SET last_seen = ?", (time.time(),))
+
+    def load(self) -> Dict[str, Tuple[int, float]]:
+        """offer -> (price, last_seen unix time); по возрастанию last_seen — как порядок LRU."""
+        with closing(sqlite3.connect(self.path)) as conn:
+            rows = conn.execute("SELECT offer, price, last_seen FROM prices ORDER BY last_seen")
+            return {offer: (price, last_seen) for offer, price, last_seen in rows}
+
+    def save(self, rows: Iterable[Tuple[str, int, float]], removed: Iterable[str] = ()) -> None:
+        # соединение на вызов: методы дергаются из asyncio.to_thread, а sqlite3 не любит шарить его между потоками
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            # FULL: fsync на каждый коммит, чтобы последний цикл пережил и отключение питания;
+            # коммит один раз в POLL_PERIOD_SEC, так что цена этому копеечная
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executemany("INSERT OR REPLACE INTO prices(offer, price, last_seen) VALUES (?, ?, ?)", rows)
+            conn.executemany("DELETE FROM prices WHERE offer = ?", ((offer,) for offer in removed))